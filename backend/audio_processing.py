@@ -6,8 +6,13 @@ Audio processing utilities:
 """
 
 import logging
+import shutil
+import wave
+from fractions import Fraction
+from math import gcd
 import numpy as np
 import soundfile as sf
+import scipy.signal
 from pathlib import Path
 
 # Ensure ffmpeg binaries are on PATH for MP3/M4A support
@@ -17,10 +22,22 @@ try:
 except Exception:
     pass
 
+# librosa is slow to import (numba/scipy registration), so load it once here
+# rather than inside every call; the functions below fail cleanly without it.
+try:
+    import librosa
+except ImportError:
+    librosa = None
+
 logger = logging.getLogger(__name__)
 
 TARGET_SR = 44100
 BIT_DEPTH = "PCM_16"
+GENDER_SR = 8000  # analysis rate for F0-based gender detection
+GENDER_HOP = 256
+GENDER_SECONDS = 5.0        # first analysis window
+GENDER_MAX_SECONDS = 10.0   # retry window when the first has too little voicing
+GENDER_MIN_VOICED_FRAMES = 64  # ~2 s of voiced speech at 8 kHz / hop 256
 
 # Mood effect parameters: (pitch_semitones_max, speed_max, gain_db_max)
 MOOD_PARAMS = {
@@ -30,6 +47,140 @@ MOOD_PARAMS = {
     "excited": (3.5,  1.22,  2.0),
 }
 
+# Anti-aliasing FIR filters for polyphase resampling, keyed by (up, down)
+_FIR_CACHE = {}
+
+
+def _resample_filter(up: int, down: int) -> np.ndarray:
+    """Kaiser-windowed low-pass FIR for an up/down polyphase resampler (cached)."""
+    key = (up, down)
+    h = _FIR_CACHE.get(key)
+    if h is None:
+        max_rate = max(up, down)
+        # Same length as scipy's resample_poly default (20 taps per phase);
+        # float32 taps keep upfirdn (and its output) in float32
+        h = scipy.signal.firwin(
+            20 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 8.0)
+        ).astype(np.float32)
+        _FIR_CACHE[key] = h
+    return h
+
+
+# 127-tap half-band low-pass for 2x upsampling (espeak-ng 22050 → 44100 Hz),
+# designed once at import. Taps at even offsets from the centre are zero, so
+# the even output phase is the input itself and the odd phase only needs the
+# 64 remaining taps (normalized to unity DC gain).
+_HALFBAND = scipy.signal.firwin(127, 0.5, window=("kaiser", 8.0))
+_HALFBAND_ODD = (_HALFBAND[0::2] / _HALFBAND[0::2].sum()).astype(np.float32)
+
+
+def _upsample_2x(y: np.ndarray) -> np.ndarray:
+    """Half-band 2x interpolation that skips the filter's zero taps."""
+    n = len(y)
+    if n == 0:
+        return y.copy()  # np.convolve rejects empty input
+    half = len(_HALFBAND_ODD) // 2
+    out = np.empty(2 * n, dtype=y.dtype)
+    out[0::2] = y
+    # Full convolution centred between y[k] and y[k + 1]
+    out[1::2] = np.convolve(y, _HALFBAND_ODD)[half:half + n]
+    return out
+
+
+def resample(y: np.ndarray, orig_sr: int, target_sr: int = TARGET_SR) -> np.ndarray:
+    """
+    Resample a mono signal with scipy's polyphase (upfirdn) resampler.
+    The filter for each rate pair is designed once and reused.
+    """
+    if orig_sr == target_sr:
+        return y
+    g = gcd(int(orig_sr), int(target_sr))
+    up, down = int(target_sr) // g, int(orig_sr) // g
+    if (up, down) == (2, 1) and np.issubdtype(y.dtype, np.floating):
+        return _upsample_2x(y)
+    return scipy.signal.resample_poly(y, up, down, window=_resample_filter(up, down))
+
+
+def _rational_ratio(x: float, max_cents: float = 0.1) -> Fraction:
+    """
+    Smallest-denominator fraction for a resampling ratio whose pitch/duration
+    error is at most max_cents. The denominator bound doubles from 256 until
+    the tolerance is met (capped at 4096; up/down stay below ~650 for the
+    MOOD_PARAMS at common rates). Filters are cached per pair, so larger
+    factors only cost a one-time design.
+    """
+    bound = 256
+    while True:
+        ratio = Fraction(x).limit_denominator(bound)
+        cents = abs(1200.0 * np.log2(float(ratio) / x))
+        if cents <= max_cents or bound >= 4096:
+            return ratio
+        bound *= 2
+
+
+def peak_amplitude(y: np.ndarray) -> float:
+    """
+    Largest absolute sample value. Two min/max reductions over y instead of
+    np.abs(y).max(), which would allocate and write a full-size temporary.
+    """
+    if y.size == 0:
+        return 0.0
+    return float(max(y.max(), -y.min()))
+
+
+def write_pcm16(path: str, y: np.ndarray, sr: int):
+    """
+    Write mono float samples in [-1, 1] as a 16-bit PCM WAV (BIT_DEPTH).
+    Converts with one float32 scratch buffer and writes through the stdlib
+    wave module, skipping libsndfile's per-call checks and float scan.
+    """
+    scratch = np.multiply(y, 32767.0, dtype=np.float32)
+    np.rint(scratch, out=scratch)
+    np.clip(scratch, -32768.0, 32767.0, out=scratch)
+    pcm = scratch.astype("<i2")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(int(sr))
+        w.writeframes(pcm.tobytes())
+
+
+def _require_librosa():
+    if librosa is None:
+        raise RuntimeError("librosa is not installed")
+
+
+def _load_mono(path: str):
+    """
+    Load audio as mono float32 at its native sample rate.
+    WAV/FLAC/OGG are read directly by libsndfile; anything it cannot decode
+    (e.g. M4A) goes through librosa's ffmpeg-backed loader.
+    """
+    try:
+        y, sr = sf.read(path, dtype="float32", always_2d=False)
+    except RuntimeError:
+        _require_librosa()
+        return librosa.load(path, sr=None, mono=True)
+    if y.ndim > 1:
+        y = np.mean(y, axis=1, dtype=np.float32)
+    return y, sr
+
+
+def _yin_f0(y: np.ndarray, sr: int) -> np.ndarray:
+    """Per-frame F0 via yin, with frames outside the speaking range set to NaN."""
+    # yin is far cheaper than pyin (no HMM/viterbi pass) and good enough
+    # for a binary male/female decision
+    f0 = librosa.yin(
+        y,
+        fmin=65.0,   # ~C2
+        fmax=400.0,
+        sr=sr,
+        frame_length=1024,
+        hop_length=GENDER_HOP,
+    )
+    # Treat estimates outside the speaking range as unvoiced
+    return np.where((f0 >= 70.0) & (f0 <= 300.0), f0, np.nan)
+
 
 def detect_gender(audio_path: str) -> str:
     """
@@ -37,19 +188,23 @@ def detect_gender(audio_path: str) -> str:
     Male F0: ~85–180 Hz | Female F0: ~165–255 Hz
     """
     try:
-        import librosa
-        y, sr = librosa.load(audio_path, sr=None, mono=True)
-        # pyin is more robust than yin for F0 estimation
-        f0, voiced_flag, _ = librosa.pyin(
-            y,
-            fmin=librosa.note_to_hz("C2"),  # ~65 Hz
-            fmax=librosa.note_to_hz("C6"),  # ~1047 Hz
-            sr=sr,
+        _require_librosa()
+        # 8 kHz is plenty for F0 (Nyquist 4 kHz ≫ 400 Hz) and cuts work ~5x.
+        # Only the start of the clip is decoded: a few seconds of voiced
+        # speech settle a binary decision.
+        y, sr = librosa.load(
+            audio_path, sr=GENDER_SR, mono=True, duration=GENDER_MAX_SECONDS
         )
-        voiced_f0 = f0[voiced_flag & ~np.isnan(f0)]
-        if len(voiced_f0) == 0:
+        short = int(GENDER_SECONDS * sr)
+        f0 = _yin_f0(y[:short], sr)
+        voiced = np.count_nonzero(~np.isnan(f0))
+        if voiced < GENDER_MIN_VOICED_FRAMES and len(y) > short:
+            # Mostly silence/noise up front — retry on the longer window
+            f0 = _yin_f0(y, sr)
+            voiced = np.count_nonzero(~np.isnan(f0))
+        if voiced == 0:
             return "unknown"
-        mean_f0 = float(np.nanmedian(voiced_f0))
+        mean_f0 = float(np.nanmedian(f0))
         # Threshold: 165 Hz separates typical male/female fundamental
         return "female" if mean_f0 >= 165 else "male"
     except Exception as e:
@@ -75,49 +230,80 @@ def apply_mood(
     Returns:
         output_path
     """
-    import librosa
-    import scipy.signal
-
     mood = mood if mood in MOOD_PARAMS else "normal"
+
+    # ── Normal: no effect at any intensity ───────────────────────────────────
+    # If the input is already 44100 Hz 16-bit mono (espeak-ng output) there is
+    # nothing to do; 16-bit samples cannot exceed full scale, so skip the
+    # decode/normalize/encode round trip entirely.
+    if mood == "normal":
+        info = sf.info(input_path)
+        if (
+            info.samplerate == TARGET_SR
+            and info.subtype == BIT_DEPTH
+            and info.channels == 1
+        ):
+            shutil.move(input_path, output_path)
+            logger.info(f"Mood 'normal' passthrough → {output_path}")
+            return output_path
+
     # Normalize intensity to [0, 1] range; intensity=3 → factor=0.5
     factor = (max(1, min(5, intensity)) - 1) / 4.0
     pitch_max, speed_max, gain_max = MOOD_PARAMS[mood]
 
-    # Load audio
-    y, sr = librosa.load(input_path, sr=None, mono=True)
+    # Load audio (float32; every stage below stays in float32)
+    y, sr = _load_mono(input_path)
 
-    # ── Pitch shift ────────────────────────────────────────────────────────────
+    # ── Pitch shift + speed in one phase-vocoder pass ────────────────────────
+    # A pitch shift is a time-stretch followed by a resample, so stretch once
+    # by rate / pitch_ratio and let the final resample to 44100 Hz (below)
+    # read the signal as if it were recorded at sr * pitch_ratio.
     n_steps = pitch_max * factor
-    if abs(n_steps) > 0.01:
-        y = librosa.effects.pitch_shift(y, sr=sr, n_steps=n_steps)
-
-    # ── Speed / time-stretch ──────────────────────────────────────────────────
+    pitch_ratio = 2.0 ** (n_steps / 12.0) if abs(n_steps) > 0.01 else 1.0
     rate = 1.0 + (speed_max - 1.0) * factor
-    if abs(rate - 1.0) > 0.005:
-        y = librosa.effects.time_stretch(y, rate=rate)
+    if abs(rate - 1.0) <= 0.005:
+        rate = 1.0
+    stretch = rate / pitch_ratio
+    if abs(stretch - 1.0) > 0.005:
+        _require_librosa()
+        # 40 ms analysis window: shorter than librosa's 2048 default at 44.1k,
+        # cheaper and less smeared for speech
+        y = librosa.effects.time_stretch(y, rate=stretch, n_fft=int(0.04 * sr))
+
+    # Work in place from here on: one contiguous float32 buffer
+    y = np.ascontiguousarray(y, dtype=np.float32)
 
     # ── Gain ──────────────────────────────────────────────────────────────────
+    # Linear until the soft-clip, so it is deferred and folded into a single
+    # scalar multiply together with the peak normalization below.
     gain_lin = 10 ** (gain_max * factor / 20.0)
-    y = y * gain_lin
+    scale = gain_lin
 
     # ── Angry: add subtle harmonic distortion ─────────────────────────────────
     if mood == "angry" and factor > 0.2:
         # soft-clip to add mild harmonic richness (perceived aggression)
         clip_threshold = 0.85 - 0.15 * factor
-        y = np.tanh(y / clip_threshold) * clip_threshold
+        np.multiply(y, gain_lin / clip_threshold, out=y)
+        np.tanh(y, out=y)
+        scale = clip_threshold
 
     # ── Normalize to prevent clipping ────────────────────────────────────────
-    peak = np.max(np.abs(y))
+    peak = peak_amplitude(y) * scale
     if peak > 0.98:
-        y = y * (0.95 / peak)
+        scale *= 0.95 / peak
+    if scale != 1.0:
+        np.multiply(y, scale, out=y)
 
-    # ── Resample to 44100 Hz ─────────────────────────────────────────────────
-    if sr != TARGET_SR:
-        y = librosa.resample(y, orig_sr=sr, target_sr=TARGET_SR)
-        sr = TARGET_SR
+    # ── Resample to 44100 Hz (completes the pitch shift) ─────────────────────
+    if pitch_ratio != 1.0:
+        ratio = _rational_ratio(sr * pitch_ratio / TARGET_SR)
+        y = resample(y, ratio.numerator, ratio.denominator)
+    elif sr != TARGET_SR:
+        y = resample(y, sr)
+    sr = TARGET_SR
 
     # ── Write 16-bit PCM WAV ──────────────────────────────────────────────────
-    sf.write(output_path, y, sr, subtype=BIT_DEPTH)
+    write_pcm16(output_path, y, sr)
     logger.info(f"Mood '{mood}' (intensity={intensity}) written → {output_path}")
     return output_path
 
@@ -128,14 +314,13 @@ def normalize_wav(input_path: str, output_path: str) -> str:
     Used for reference audio import.
     """
     try:
-        import librosa
-        y, sr = librosa.load(input_path, sr=None, mono=True)
+        y, sr = _load_mono(input_path)
         if sr != TARGET_SR:
-            y = librosa.resample(y, orig_sr=sr, target_sr=TARGET_SR)
-        peak = np.max(np.abs(y))
+            y = resample(y, sr)
+        peak = peak_amplitude(y)
         if peak > 0:
-            y = y * (0.9 / peak)
-        sf.write(output_path, y, TARGET_SR, subtype=BIT_DEPTH)
+            np.multiply(y, 0.9 / peak, out=y)
+        write_pcm16(output_path, y, TARGET_SR)
         return output_path
     except Exception as e:
         logger.error(f"normalize_wav failed: {e}")
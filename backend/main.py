@@ -13,14 +13,16 @@ Endpoints:
 """
 
 import os
+import stat
 import uuid
 import logging
 import tempfile
 from pathlib import Path
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
@@ -57,6 +59,25 @@ GENERATED_DIR.mkdir(parents=True, exist_ok=True)
 EXPORTS_DIR = Path("data/exports")
 EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
 
+# When served behind nginx, set to an `internal` location aliased to backend/
+# (e.g. "/_voicelab/") and audio is handed off via X-Accel-Redirect so nginx
+# streams it with sendfile instead of Python.
+ACCEL_REDIRECT_PREFIX = os.environ.get("VOICELAB_ACCEL_REDIRECT", "")
+
+def audio_response(path: Path) -> Response:
+    """Serve a WAV file, stat'ing it once for both the 404 check and headers."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        raise HTTPException(404)
+    # stat_result bypasses Starlette's own regular-file check (e.g. "..")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(404)
+    if ACCEL_REDIRECT_PREFIX:
+        target = ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + path.as_posix()
+        return Response(media_type="audio/wav", headers={"X-Accel-Redirect": target})
+    return FileResponse(str(path), media_type="audio/wav", stat_result=stat_result)
+
 # ── Status ────────────────────────────────────────────────────────────────────
 @app.get("/api/status")
 def get_status():
@@ -76,10 +97,14 @@ class GenerateRequest(BaseModel):
     intensity: int = Field(3, ge=1, le=5)
 
 @app.post("/api/tts/generate")
-def generate_tts(req: GenerateRequest):
+async def generate_tts(req: GenerateRequest):
     if not engine.is_ready:
         raise HTTPException(503, detail=f"Model not ready. Status: {engine.status}")
+    # Voice lookups, synthesis and mood FX all block (DB lock, disk, CPU/GPU);
+    # run the whole pipeline on a worker thread to keep the event loop free
+    return await run_in_threadpool(_generate_tts, req)
 
+def _generate_tts(req: GenerateRequest) -> dict:
     voice = bank.get_voice(req.voice_id)
     if not voice:
         raise HTTPException(404, detail="Voice not found")
@@ -96,6 +121,7 @@ def generate_tts(req: GenerateRequest):
             speaker_wav=str(ref_path),
             language=req.language,
             output_path=raw_path,
+            voice_id=req.voice_id,
         )
     except Exception as e:
         logger.error(f"TTS generation error: {e}")
@@ -121,13 +147,11 @@ def generate_tts(req: GenerateRequest):
 
 @app.get("/api/generated/{filename}")
 def get_generated_audio(filename: str):
-    path = GENERATED_DIR / filename
-    if not path.exists():
-        raise HTTPException(404)
-    return FileResponse(str(path), media_type="audio/wav")
+    return audio_response(GENERATED_DIR / filename)
 
 # ── Voice Cloning ─────────────────────────────────────────────────────────────
 ALLOWED_EXTENSIONS = {".wav", ".mp3", ".m4a", ".ogg", ".flac"}
+UPLOAD_CHUNK_SIZE = 1 << 16  # 64 KB
 
 @app.post("/api/voices/clone")
 async def clone_voice(
@@ -141,9 +165,10 @@ async def clone_voice(
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(400, detail=f"Unsupported file type: {ext}")
 
-    # Save upload to temp file
+    # Stream upload to temp file in fixed-size chunks
     with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-        tmp.write(await audio.read())
+        while chunk := await audio.read(UPLOAD_CHUNK_SIZE):
+            tmp.write(chunk)
         tmp_path = tmp.name
 
     # Normalize to WAV 44100 Hz 16-bit for storage
@@ -213,6 +238,7 @@ def update_voice(voice_id: str, req: UpdateVoiceRequest):
 def delete_voice(voice_id: str):
     if not bank.delete_voice(voice_id):
         raise HTTPException(404)
+    engine.forget_speaker(voice_id)
     return {"ok": True}
 
 @app.get("/api/voices/{voice_id}/audio")
@@ -220,7 +246,7 @@ def get_voice_audio(voice_id: str):
     ref_path = bank.get_reference_path(voice_id)
     if not ref_path:
         raise HTTPException(404)
-    return FileResponse(str(ref_path), media_type="audio/wav")
+    return audio_response(ref_path)
 
 # ── Serve frontend in production ─────────────────────────────────────────────
 frontend_dist = Path("../dist")
@@ -5,10 +5,18 @@ Fallback: espeak-ng — offline, zero dependencies, lower quality but always ava
 """
 
 import os
+import ctypes
+import ctypes.util
 import subprocess
 import threading
 import logging
 import shutil
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from audio_processing import peak_amplitude, resample, write_pcm16
 
 # Auto-accept Coqui TTS non-commercial CPML license
 os.environ.setdefault("COQUI_TOS_AGREED", "1")
@@ -42,6 +50,111 @@ ESPEAK_VOICE_MAP = {
 }
 
 MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+XTTS_SENTENCE_PAUSE = 10000  # samples of silence after each sentence (as Synthesizer.tts)
+
+# libespeak-ng constants (speak_lib.h)
+_AUDIO_OUTPUT_SYNCHRONOUS = 2
+_POS_CHARACTER = 1
+_ESPEAK_CHARS_UTF8 = 1
+# Return an error from espeak_Initialize instead of calling exit(1) on failure
+_ESPEAK_INITIALIZE_DONT_EXIT = 0x8000
+_EE_OK = 0
+
+# int SynthCallback(short *wav, int numsamples, espeak_EVENT *events)
+_SYNTH_CALLBACK = ctypes.CFUNCTYPE(
+    ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p
+)
+
+
+class EspeakLibrary:
+    """
+    In-process espeak-ng via ctypes: synthesizes straight into memory,
+    avoiding a fork/exec, voice load and temp WAV per request.
+    libespeak-ng keeps global state, so synthesis is serialized.
+    """
+
+    def __init__(self):
+        name = ctypes.util.find_library("espeak-ng") or "libespeak-ng.so.1"
+        lib = ctypes.CDLL(name)
+        lib.espeak_Initialize.argtypes = [
+            ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int,
+        ]
+        lib.espeak_Initialize.restype = ctypes.c_int
+        lib.espeak_SetSynthCallback.argtypes = [_SYNTH_CALLBACK]
+        lib.espeak_SetSynthCallback.restype = None
+        lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        lib.espeak_SetVoiceByName.restype = ctypes.c_int
+        lib.espeak_Synth.argtypes = [
+            ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int,
+            ctypes.c_uint, ctypes.c_uint, ctypes.POINTER(ctypes.c_uint),
+            ctypes.c_void_p,
+        ]
+        lib.espeak_Synth.restype = ctypes.c_int
+
+        self.sample_rate = lib.espeak_Initialize(
+            _AUDIO_OUTPUT_SYNCHRONOUS, 0, None, _ESPEAK_INITIALIZE_DONT_EXIT
+        )
+        if self.sample_rate <= 0:
+            raise OSError("espeak_Initialize failed")
+        self._lib = lib
+        self._lock = threading.Lock()
+        self._chunks = []
+        # Keep a reference so the C callback is not garbage-collected
+        self._callback = _SYNTH_CALLBACK(self._on_samples)
+        lib.espeak_SetSynthCallback(self._callback)
+
+    def _on_samples(self, wav, numsamples, events):
+        if wav and numsamples > 0:
+            self._chunks.append(ctypes.string_at(wav, numsamples * 2))
+        return 0
+
+    def synthesize(self, text: str, voice: str) -> np.ndarray:
+        """Return int16 mono samples at self.sample_rate."""
+        data = text.encode("utf-8")
+        with self._lock:
+            self._chunks = []
+            if self._lib.espeak_SetVoiceByName(voice.encode()) != _EE_OK:
+                raise RuntimeError(f"espeak-ng voice not found: {voice}")
+            err = self._lib.espeak_Synth(
+                data, len(data) + 1, 0, _POS_CHARACTER, 0,
+                _ESPEAK_CHARS_UTF8, None, None,
+            )
+            if err != _EE_OK:
+                raise RuntimeError(f"espeak-ng error code {err}")
+            pcm = b"".join(self._chunks)
+            self._chunks = []
+        return np.frombuffer(pcm, dtype=np.int16)
+
+
+def _load_espeak_library():
+    try:
+        return EspeakLibrary()
+    except Exception as e:
+        logger.info(f"libespeak-ng unavailable ({e}); using espeak-ng CLI")
+        return None
+
+
+def _quantize_xtts(tts):
+    """
+    Experimental, partial dynamic int8 quantization (opt-in via
+    VOICELAB_QUANTIZE=1). Only torch.nn.Linear modules are converted: the
+    heads, perceiver and vocoder. The GPT decoder's attention/MLP layers are
+    transformers Conv1D and stay FP32, so no meaningful speedup is expected.
+    Weights are stored as int8 and activations are quantized on the fly, so
+    callers keep passing float32 tensors. CPU only; a CUDA model is left
+    untouched.
+    """
+    import torch
+
+    model = tts.synthesizer.tts_model
+    device = next(model.parameters()).device
+    if device.type != "cpu":
+        logger.warning(f"VOICELAB_QUANTIZE ignored: model is on {device}")
+        return
+    tts.synthesizer.tts_model = torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    logger.info("XTTS-v2 nn.Linear layers quantized to int8 (experimental)")
 
 
 class TTSEngine:
@@ -55,9 +168,16 @@ class TTSEngine:
     def __init__(self):
         self._tts = None
         self._lock = threading.Lock()
+        # XTTS-v2 inference keeps per-call state on the shared model (the GPT
+        # prefix embedding is stored on the inference module and read back at
+        # every decoding step), so only one synthesis may run at a time
+        self._infer_lock = threading.Lock()
         self._status = "idle"   # idle | loading | ready | error
         self._error_msg = None
         self._backend = None    # "xtts" | "espeak"
+        self._espeak_lib = None
+        # voice_id → (gpt_cond_latent, speaker_embedding) for XTTS-v2
+        self._speaker_cache = {}
 
     @property
     def status(self) -> str:
@@ -90,6 +210,12 @@ class TTSEngine:
         try:
             from TTS.api import TTS
             tts = TTS(MODEL_NAME, progress_bar=False)
+            if os.environ.get("VOICELAB_QUANTIZE") == "1":
+                try:
+                    _quantize_xtts(tts)
+                except Exception as e:
+                    # Keep the loaded FP32 model rather than dropping to espeak-ng
+                    logger.warning(f"XTTS-v2 quantization failed, using FP32: {e}")
             with self._lock:
                 self._tts = tts
                 self._status = "ready"
@@ -97,8 +223,10 @@ class TTSEngine:
             logger.info("XTTS-v2 loaded ✓")
         except Exception as e:
             logger.warning(f"XTTS-v2 unavailable: {e}. Falling back to espeak-ng.")
-            if shutil.which("espeak-ng"):
+            espeak_lib = _load_espeak_library()
+            if espeak_lib or shutil.which("espeak-ng"):
                 with self._lock:
+                    self._espeak_lib = espeak_lib
                     self._status = "ready"
                     self._backend = "espeak"
                     self._error_msg = str(e)
@@ -130,6 +258,7 @@ class TTSEngine:
         speaker_wav: str,
         language: str,
         output_path: str,
+        voice_id: Optional[str] = None,
     ) -> str:
         """
         Synthesize speech.
@@ -142,6 +271,9 @@ class TTSEngine:
             speaker_wav:  Path to reference WAV (used by XTTS-v2 only)
             language:     Language code (e.g. 'pt' for PT-BR)
             output_path:  Destination WAV file path
+            voice_id:     Cache key for the XTTS-v2 speaker conditioning, so the
+                          speaker encoder only runs on a voice's first request
+                          (uncached when omitted)
 
         Returns:
             output_path
@@ -149,28 +281,84 @@ class TTSEngine:
         self.ensure_ready()
 
         if self._backend == "xtts":
-            return self._generate_xtts(text, speaker_wav, language, output_path)
+            return self._generate_xtts(text, speaker_wav, language, output_path, voice_id)
         else:
             return self._generate_espeak(text, language, output_path)
 
-    def _generate_xtts(self, text, speaker_wav, language, output_path):
+    def forget_speaker(self, voice_id: str):
+        """Drop cached speaker conditioning (e.g. when a voice is deleted)."""
+        self._speaker_cache.pop(voice_id, None)
+
+    def _generate_xtts(self, text, speaker_wav, language, output_path, voice_id=None):
         lang = language if language in XTTS_LANGUAGES else "pt"
-        logger.info(f"XTTS-v2 generate: lang={lang}")
-        with self._lock:
-            self._tts.tts_to_file(
-                text=text,
-                speaker_wav=speaker_wav,
-                language=lang,
-                file_path=output_path,
-                split_sentences=True,
-            )
+        synth = self._tts.synthesizer
+        model = synth.tts_model
+        cfg = model.config
+        # Same sentence split and inter-sentence pause as tts_to_file(split_sentences=True)
+        sentences = synth.split_into_sentences(text)
+        logger.info(f"XTTS-v2 generate: lang={lang} sentences={len(sentences)}")
+
+        # Requests are not micro-batched: Xtts.inference decodes one text
+        # autoregressively and has no padded/batched entry point, so stacking
+        # latents from several requests is not possible without forking the
+        # model. Requests are serialized on the inference lock instead.
+        wavs = []
+        with self._infer_lock:
+            latents = self._speaker_cache.get(voice_id) if voice_id else None
+            if latents is None:
+                logger.info(f"XTTS-v2 computing speaker latents: voice={voice_id}")
+                latents = model.get_conditioning_latents(
+                    audio_path=speaker_wav,
+                    max_ref_length=cfg.max_ref_len,
+                    gpt_cond_len=cfg.gpt_cond_len,
+                    gpt_cond_chunk_len=cfg.gpt_cond_chunk_len,
+                    sound_norm_refs=cfg.sound_norm_refs,
+                )
+                if voice_id:
+                    self._speaker_cache[voice_id] = latents
+            gpt_cond_latent, speaker_embedding = latents
+            for sentence in sentences:
+                out = model.inference(
+                    sentence,
+                    lang,
+                    gpt_cond_latent,
+                    speaker_embedding,
+                    temperature=cfg.temperature,
+                    length_penalty=cfg.length_penalty,
+                    repetition_penalty=cfg.repetition_penalty,
+                    top_k=cfg.top_k,
+                    top_p=cfg.top_p,
+                )
+                wavs.append(np.asarray(out["wav"], dtype=np.float32).reshape(-1))
+                wavs.append(np.zeros(XTTS_SENTENCE_PAUSE, dtype=np.float32))
+
+        wav = np.concatenate(wavs)
+        # Scale to full scale like Coqui's save_wav, so output level is
+        # consistent and nothing above 1.0 is clipped on write
+        np.multiply(wav, 1.0 / max(0.01, peak_amplitude(wav)), out=wav)
+        write_pcm16(output_path, wav, cfg.audio.output_sample_rate)
         return output_path
 
     def _generate_espeak(self, text, language, output_path):
         voice = ESPEAK_VOICE_MAP.get(language, "pt-br")
-        tmp_wav = output_path + ".raw.wav"
         logger.info(f"espeak-ng generate: voice={voice}")
 
+        if self._espeak_lib is not None:
+            pcm = self._espeak_lib.synthesize(text, voice)
+            y, sr = pcm.astype(np.float32), self._espeak_lib.sample_rate
+        else:
+            y, sr = self._run_espeak_cli(text, voice, output_path + ".raw.wav")
+
+        # Normalize to 44100 Hz 16-bit (espeak outputs at 22050 Hz by default)
+        if sr != 44100:
+            y = resample(y, sr, 44100)
+        peak = peak_amplitude(y)
+        if peak > 0:
+            y = y * (0.85 / peak)
+        write_pcm16(output_path, y, 44100)
+        return output_path
+
+    def _run_espeak_cli(self, text, voice, tmp_wav):
         result = subprocess.run(
             ["espeak-ng", "-v", voice, "-w", tmp_wav, "--", text],
             capture_output=True, text=True,
@@ -178,24 +366,16 @@ class TTSEngine:
         if result.returncode != 0:
             raise RuntimeError(f"espeak-ng error: {result.stderr}")
 
-        # Normalize to 44100 Hz 16-bit (espeak outputs at 22050 Hz by default)
-        import soundfile as sf
-        import librosa
-        import numpy as np
-
-        y, sr = librosa.load(tmp_wav, sr=None, mono=True)
-        if sr != 44100:
-            y = librosa.resample(y, orig_sr=sr, target_sr=44100)
-        peak = np.max(np.abs(y))
-        if peak > 0:
-            y = y * (0.85 / peak)
-        sf.write(output_path, y, 44100, subtype="PCM_16")
-
         try:
-            os.unlink(tmp_wav)
-        except Exception:
-            pass
-        return output_path
+            y, sr = sf.read(tmp_wav, dtype="float32")
+        finally:
+            try:
+                os.unlink(tmp_wav)
+            except Exception:
+                pass
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+        return y, sr
 
 
 # Singleton
@@ -1,42 +1,154 @@
 """
 Voice Bank: persistent storage for cloned voice profiles.
-Uses a JSON file for metadata; reference audio files stored on disk.
+Uses a SQLite database for metadata; reference audio files stored on disk.
 """
 
 import json
+import os
 import shutil
+import sqlite3
+import threading
 import uuid
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
-VOICES_JSON = "data/voices.json"
+VOICES_DB = "data/voices.db"
+VOICES_JSON = "data/voices.json"   # legacy store, imported once if present
 REFERENCES_DIR = "data/references"
+VOICE_CACHE_SIZE = 256
+# Column defaults applied to missing/null fields of legacy voices.json entries
+_LEGACY_DEFAULTS = {
+    "name": "",
+    "gender": "unknown",
+    "language": "pt",
+    "description": "",
+    "created_at": "",
+}
+
+VOICE_COLUMNS = (
+    "id", "name", "gender", "language", "description",
+    "reference_file", "created_at",
+)
+_SELECT = f"SELECT {', '.join(VOICE_COLUMNS)} FROM voices"
+_INSERT = (
+    f"INSERT INTO voices ({', '.join(VOICE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(VOICE_COLUMNS))})"
+)
 
 
 class VoiceBank:
     def __init__(self, base_dir: str = "."):
         self.base = Path(base_dir)
+        self.db_path = self.base / VOICES_DB
         self.json_path = self.base / VOICES_JSON
         self.refs_dir = self.base / REFERENCES_DIR
         self.refs_dir.mkdir(parents=True, exist_ok=True)
-        self._ensure_json()
-
-    def _ensure_json(self):
+        # Autocommit connection shared by FastAPI's worker threads; the RLock
+        # serializes use of the connection and the cache
+        self._db = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, isolation_level=None
+        )
+        self._db.row_factory = sqlite3.Row
+        # WAL: readers never see a half-written transaction and a crash rolls
+        # back cleanly; FULL fsyncs every commit
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._lock = threading.RLock()
+        # LRU of voice rows by id; TTS requests look a voice up several times
+        self._cache = OrderedDict()
+        self._ensure_schema()
+        self._import_json()
+
+    def _ensure_schema(self):
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS voices (
+                id             TEXT PRIMARY KEY,
+                name           TEXT NOT NULL,
+                gender         TEXT NOT NULL DEFAULT 'unknown',
+                language       TEXT NOT NULL DEFAULT 'pt',
+                description    TEXT NOT NULL DEFAULT '',
+                reference_file TEXT NOT NULL,
+                created_at     TEXT NOT NULL
+            )
+            """
+        )
+        # list_voices walks this index newest-first and filters while
+        # scanning, so no result list has to be sorted
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS voices_created_at "
+            "ON voices (created_at DESC)"
+        )
+
+    def _import_json(self):
+        """One-time migration of voices from the old voices.json store."""
         if not self.json_path.exists():
-            self.json_path.write_text(json.dumps({"voices": []}, indent=2))
-
-    def _load(self) -> dict:
+            return
         try:
-            return json.loads(self.json_path.read_text())
-        except Exception:
-            return {"voices": []}
-
-    def _save(self, data: dict):
-        self.json_path.write_text(json.dumps(data, indent=2))
+            voices = json.loads(self.json_path.read_text()).get("voices", [])
+        except Exception as e:
+            logger.warning(f"Could not read legacy {self.json_path}: {e}")
+            return
+        rows, invalid = [], []
+        for v in voices:
+            row = {c: v.get(c) for c in VOICE_COLUMNS}
+            for c, default in _LEGACY_DEFAULTS.items():
+                if row[c] is None:
+                    row[c] = default
+            if not row["id"] or not row["reference_file"]:
+                invalid.append(row["id"] or row["name"])
+            else:
+                rows.append(tuple(row[c] for c in VOICE_COLUMNS))
+        if invalid:
+            # Keep voices.json so nothing is silently lost
+            logger.error(
+                f"Legacy import skipped: {len(invalid)} voices in {self.json_path} "
+                f"lack an id or reference_file: {invalid}"
+            )
+            return
+
+        imported = 0
+        with self._transaction() as db:
+            for row in rows:
+                try:
+                    db.execute(_INSERT, row)
+                    imported += 1
+                except sqlite3.IntegrityError:
+                    pass  # already migrated (e.g. crash before the rename below)
+        os.replace(self.json_path, self.json_path.with_suffix(".json.bak"))
+        skipped = len(rows) - imported
+        logger.info(
+            f"Imported {imported} voices from {self.json_path}"
+            + (f" ({skipped} already present)" if skipped else "")
+        )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _cache_put(self, voice: dict):
+        with self._lock:
+            self._cache[voice["id"]] = voice
+            self._cache.move_to_end(voice["id"])
+            if len(self._cache) > VOICE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, voice_id: str):
+        with self._lock:
+            self._cache.pop(voice_id, None)
 
     def add_voice(
         self,
@@ -62,9 +174,8 @@ class VoiceBank:
             "created_at": datetime.utcnow().isoformat(),
         }
 
-        data = self._load()
-        data["voices"].append(voice)
-        self._save(data)
+        with self._lock:
+            self._db.execute(_INSERT, tuple(voice[c] for c in VOICE_COLUMNS))
         logger.info(f"Voice saved: {name} ({vid})")
         return voice
 
@@ -73,46 +184,61 @@ class VoiceBank:
         gender: Optional[str] = None,
         language: Optional[str] = None,
     ) -> list:
-        data = self._load()
-        voices = data.get("voices", [])
+        clauses, params = [], []
         if gender and gender != "all":
-            voices = [v for v in voices if v.get("gender") == gender]
+            clauses.append("gender = ?")
+            params.append(gender)
         if language and language != "all":
-            voices = [v for v in voices if v.get("language") == language]
-        return sorted(voices, key=lambda v: v.get("created_at", ""), reverse=True)
+            clauses.append("language = ?")
+            params.append(language)
+        sql = _SELECT
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC"
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, params)]
 
     def get_voice(self, voice_id: str) -> Optional[dict]:
-        data = self._load()
-        for v in data.get("voices", []):
-            if v["id"] == voice_id:
-                return v
-        return None
+        with self._lock:
+            voice = self._cache.get(voice_id)
+            if voice is not None:
+                self._cache.move_to_end(voice_id)
+                return dict(voice)
+            row = self._db.execute(f"{_SELECT} WHERE id = ?", (voice_id,)).fetchone()
+            if not row:
+                return None
+            voice = dict(row)
+            self._cache_put(voice)
+            return dict(voice)
 
     def update_voice(self, voice_id: str, **kwargs) -> Optional[dict]:
-        data = self._load()
-        for v in data["voices"]:
-            if v["id"] == voice_id:
-                allowed = {"name", "gender", "language", "description"}
-                for k, val in kwargs.items():
-                    if k in allowed:
-                        v[k] = val
-                self._save(data)
-                return v
-        return None
+        allowed = {"name", "gender", "language", "description"}
+        updates = {k: val for k, val in kwargs.items() if k in allowed}
+        with self._lock:
+            if updates:
+                cur = self._db.execute(
+                    f"UPDATE voices SET {', '.join(f'{k} = ?' for k in updates)} "
+                    "WHERE id = ?",
+                    (*updates.values(), voice_id),
+                )
+                self._cache_drop(voice_id)
+                if cur.rowcount == 0:
+                    return None
+            return self.get_voice(voice_id)
 
     def delete_voice(self, voice_id: str) -> bool:
-        data = self._load()
-        voice = next((v for v in data["voices"] if v["id"] == voice_id), None)
-        if not voice:
-            return False
-
-        # Remove reference file
+        with self._lock:
+            voice = self.get_voice(voice_id)
+            if not voice:
+                return False
+            self._db.execute("DELETE FROM voices WHERE id = ?", (voice_id,))
+            self._cache_drop(voice_id)
+
+        # Remove reference file only once the row is gone, so a crash can leave
+        # an orphaned file but never a voice pointing at missing audio
         ref = self.base / voice.get("reference_file", "")
         if ref.exists():
             ref.unlink()
-
-        data["voices"] = [v for v in data["voices"] if v["id"] != voice_id]
-        self._save(data)
         return True
 
     def get_reference_path(self, voice_id: str) -> Optional[Path]: